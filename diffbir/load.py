@@ -73,6 +73,7 @@ class Stage2_load:
                     [
                         'float32',
                         'float16',
+                        'bfloat16',
                     ], {
                         "default": 'float32'
                     }),
@@ -144,6 +145,7 @@ class Stage1_load:
                     [
                         'float32',
                         'float16',
+                        'bfloat16',
                     ], {
                         "default": 'float32'
                     }),
@@ -221,6 +223,7 @@ class Simple_load:
                     [
                         'float32',
                         'float16',
+                        'bfloat16',
                     ], {
                         "default": 'float32'
                     }),
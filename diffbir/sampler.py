@@ -83,6 +83,7 @@ class DiffBIR_sample_advanced:
                         "default": 'latent'
                     }),
             "g_repeat": ("INT", {"default": 1, "min": 1, "max": 0xffffffffffffffff, "step": 1}),
+            "compile_model": ("BOOLEAN", {"default": True}),
             }
         }
 
@@ -95,7 +96,7 @@ class DiffBIR_sample_advanced:
     def sample(self, stage1_model, task, cldm, diffusion, infer_type, image, upscale_ratio, steps, cfg, 
                better_start, tiled, tile_size, tile_stride, keep_stage1_loaded, stage1_tile, stage1_tile_size, 
                stage1_tile_stride, pos_prompt, neg_prompt, seed, device, guidance, g_loss, 
-               g_scale, g_start, g_stop, g_space, g_repeat):
+               g_scale, g_start, g_stop, g_space, g_repeat, compile_model):
         device = check_device(device)
         print(image.shape)
 
@@ -123,6 +124,7 @@ class DiffBIR_sample_advanced:
             g_stop=g_stop,
             g_space=g_space,
             g_repeat=g_repeat,
+            compile_model=compile_model,
             output='',
             seed=seed,
             device=device
@@ -178,6 +180,8 @@ class DiffBIR_sample:
                         "default": 'cuda'
                     }),
 
+            }, "optional": {
+            "compile_model": ("BOOLEAN", {"default": True}),
             }
         }
 
@@ -189,7 +193,7 @@ class DiffBIR_sample:
 
     def sample(self, stage1_model, cldm, diffusion, infer_type, image, upscale_ratio, steps, cfg, 
                better_start, tiled, tile_size, tile_stride, pos_prompt, neg_prompt, 
-               seed, device):
+               seed, device, compile_model=True):
         device = check_device(device)
         keep_stage1_loaded = True
         print(image.shape)
@@ -218,6 +222,7 @@ class DiffBIR_sample:
             g_stop=-1,
             g_space="latent",
             g_repeat=1,
+            compile_model=compile_model,
             output='',
             seed=seed,
             device=device
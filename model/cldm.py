@@ -127,18 +127,21 @@ class ControlLDM(nn.Module):
         image.div_(count)
         return image
 
-    def prepare_condition(self, clean: torch.Tensor, txt: List[str]) -> Dict[str, torch.Tensor]:
-        return dict(
-            c_txt=self.clip.encode(txt),
-            c_img=self.vae_encode(clean * 2 - 1, sample=False)
-        )
-    
+    def pair_condition(self, c_img: torch.Tensor, txt: List[str], neg_txt: List[str]) -> Tuple[Dict[str, torch.Tensor]]:
+        # cond and uncond share the image condition, encode both prompts in one batch
+        c_txt = self.clip.encode(txt + neg_txt)
+        cond = dict(c_txt=c_txt[:len(txt)], c_img=c_img)
+        uncond = dict(c_txt=c_txt[len(txt):], c_img=c_img)
+        return cond, uncond
+
+    def prepare_cfg_condition(self, clean: torch.Tensor, txt: List[str], neg_txt: List[str]) -> Tuple[Dict[str, torch.Tensor]]:
+        c_img = self.vae_encode(clean * 2 - 1, sample=False)
+        return self.pair_condition(c_img, txt, neg_txt)
+
     @count_vram_usage
-    def prepare_condition_tiled(self, clean: torch.Tensor, txt: List[str], tile_size: int, tile_stride: int) -> Dict[str, torch.Tensor]:
-        return dict(
-            c_txt=self.clip.encode(txt),
-            c_img=self.vae_encode_tiled(clean * 2 - 1, tile_size, tile_stride, sample=False)
-        )
+    def prepare_cfg_condition_tiled(self, clean: torch.Tensor, txt: List[str], neg_txt: List[str], tile_size: int, tile_stride: int) -> Tuple[Dict[str, torch.Tensor]]:
+        c_img = self.vae_encode_tiled(clean * 2 - 1, tile_size, tile_stride, sample=False)
+        return self.pair_condition(c_img, txt, neg_txt)
 
     def forward(self, x_noisy, t, cond):
         c_txt = cond["c_txt"]
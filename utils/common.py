@@ -1,4 +1,5 @@
 from typing import Mapping, Any, Tuple, Callable
+import functools
 import importlib
 import os
 from urllib.parse import urlparse
@@ -24,22 +25,31 @@ def instantiate_from_config(config: Mapping[str, Any]) -> Any:
     return get_obj_from_str(config["target"])(**config.get("params", dict()))
 
 
-def wavelet_blur(image: Tensor, radius: int):
+@functools.lru_cache(maxsize=None)
+def wavelet_kernel(dtype: torch.dtype, device: torch.device) -> Tensor:
     """
-    Apply wavelet blur to the input tensor.
+    Build the depthwise blur kernel once per dtype & device, so that the blur
+    doesn't upload a new kernel to the device on every call.
     """
-    # input shape: (1, 3, H, W)
     # convolution kernel
     kernel_vals = [
         [0.0625, 0.125, 0.0625],
         [0.125, 0.25, 0.125],
         [0.0625, 0.125, 0.0625],
     ]
-    kernel = torch.tensor(kernel_vals, dtype=image.dtype, device=image.device)
+    kernel = torch.tensor(kernel_vals, dtype=dtype, device=device)
     # add channel dimensions to the kernel to make it a 4D tensor
     kernel = kernel[None, None]
     # repeat the kernel across all input channels
-    kernel = kernel.repeat(3, 1, 1, 1)
+    return kernel.repeat(3, 1, 1, 1)
+
+
+def wavelet_blur(image: Tensor, radius: int):
+    """
+    Apply wavelet blur to the input tensor.
+    """
+    # input shape: (1, 3, H, W)
+    kernel = wavelet_kernel(image.dtype, image.device)
     image = F.pad(image, (radius, radius, radius, radius), mode='replicate')
     # apply convolution
     output = F.conv2d(image, kernel, groups=3, dilation=radius)
@@ -51,12 +61,12 @@ def wavelet_decomposition(image: Tensor, levels=5):
     Apply wavelet decomposition to the input tensor.
     This function only returns the low frequency & the high frequency.
     """
-    high_freq = torch.zeros_like(image)
+    low_freq = image
     for i in range(levels):
         radius = 2 ** i
-        low_freq = wavelet_blur(image, radius)
-        high_freq += (image - low_freq)
-        image = low_freq
+        low_freq = wavelet_blur(low_freq, radius)
+    # the high frequency of every level sums up to image - low_freq
+    high_freq = image - low_freq
 
     return high_freq, low_freq
 
@@ -7,20 +7,22 @@ grandparent_dir = os.path.dirname(parent_dir)
 great_grandparent_dir = os.path.dirname(grandparent_dir)
 sys.path.append(great_grandparent_dir)
 
-from typing import overload, Tuple, Optional
+from typing import overload, Tuple, Optional, Callable, Dict, Any, ContextManager
+import contextlib
+import functools
 import time
+import weakref
 
 import torch
 from torch import nn
 from torch.nn import functional as F
 import numpy as np
-from PIL import Image
-from einops import rearrange
 
 
 import comfy
 from comfy import model_management
 
+from ..model import AutoencoderKL
 from ..model.cldm import ControlLDM
 from ..model.gaussian_diffusion import Diffusion
 from ..model.bsrnet import RRDBNet
@@ -28,39 +30,142 @@ from ..model.swinir import SwinIR
 from ..model.scunet import SCUNet
 from ..utils.sampler import SpacedSampler
 from ..utils.cond_fn import Guidance
-from ..utils.common import wavelet_decomposition, wavelet_reconstruction, count_vram_usage
+from ..utils.common import (
+    wavelet_decomposition, wavelet_reconstruction, count_vram_usage,
+    sliding_windows, gaussian_weights
+)
 
 
 def bicubic_resize(img: np.ndarray, scale: float) -> np.ndarray:
-    pil = Image.fromarray(img)
-    res = pil.resize(tuple(int(x * scale) for x in pil.size), Image.BICUBIC)
-    return np.array(res)
+    # antialiased bicubic in torch matches PIL's filter without the PIL roundtrip
+    h, w = img.shape[:2]
+    x = torch.from_numpy(img).permute(2, 0, 1)[None].float()
+    x = F.interpolate(x, size=(int(h * scale), int(w * scale)), mode="bicubic", antialias=True)
+    return x[0].permute(1, 2, 0).round().clamp(0, 255).byte().numpy()
+
+
+def resize_to(imgs: torch.Tensor, size: Tuple[int]) -> torch.Tensor:
+    if tuple(imgs.shape[2:]) == tuple(size):
+        return imgs
+    return F.interpolate(imgs, size=size, mode="bicubic", antialias=True)
 
 
 def resize_short_edge_to(imgs: torch.Tensor, size: int) -> torch.Tensor:
     _, _, h, w = imgs.size()
+    if min(h, w) == size:
+        return imgs
     if h == w:
         new_h, new_w = size, size
     elif h < w:
         new_h, new_w = size, int(w * (size / h))
     else:
         new_h, new_w = int(h * (size / w)), size
-    return F.interpolate(imgs, size=(new_h, new_w), mode="bicubic", antialias=True)
+    return resize_to(imgs, (new_h, new_w))
+
+
+# padded sizes used by compiled pipelines, so that every input hits one of a few graphs
+PAD_BUCKETS = (512, 768, 1024, 1536, 2048)
 
 
-def pad_to_multiples_of(imgs: torch.Tensor, multiple: int) -> torch.Tensor:
+def next_bucket(x: int, multiple: int, buckets: Tuple[int] = ()) -> int:
+    for bucket in buckets:
+        if bucket >= x and bucket % multiple == 0:
+            return bucket
+    return (x // multiple + int(x % multiple != 0)) * multiple
+
+
+def pad_to_multiples_of(imgs: torch.Tensor, multiple: int, buckets: Tuple[int] = ()) -> torch.Tensor:
     _, _, h, w = imgs.size()
-    if h % multiple == 0 and w % multiple == 0:
-        return imgs.clone()
-    # get_pad = lambda x: (x // multiple + 1) * multiple - x
-    get_pad = lambda x: (x // multiple + int(x % multiple != 0)) * multiple - x
-    ph, pw = get_pad(h), get_pad(w)
+    ph, pw = next_bucket(h, multiple, buckets) - h, next_bucket(w, multiple, buckets) - w
+    if ph == 0 and pw == 0:
+        return imgs
     return F.pad(imgs, pad=(0, pw, 0, ph), mode="constant", value=0)
 
 
+def postprocess(sample: torch.Tensor, clean: torch.Tensor, final_size: Tuple[int]) -> torch.Tensor:
+    # colorfix (borrowed from StableSR, thanks for their work)
+    sample = (sample + 1) / 2
+    sample = wavelet_reconstruction(sample, clean)
+    # resize to desired output size
+    sample = resize_to(sample, final_size)
+    # tensor to image
+    return sample.permute(0, 2, 3, 1).contiguous()
+
+
+def inference_mode_unless_guided(func: Callable) -> Callable:
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        # restoration guidance needs autograd inside the sampler, which inference mode forbids
+        with torch.no_grad() if self.cond_fn else torch.inference_mode():
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+# a new pipeline is built for every sampler run, so state meant to be reused between
+# runs is kept per diffusion model, which the loader nodes keep alive
+_diffusion_state: "weakref.WeakKeyDictionary[Diffusion, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+
+
+def diffusion_state(diffusion: Diffusion) -> Dict[str, Any]:
+    return _diffusion_state.setdefault(diffusion, {})
+
+
+def compile_module(state: Dict[str, Any], name: str, module: nn.Module) -> nn.Module:
+    # torch.compile wraps the module and leaves the shared model untouched, runs that
+    # don't compile just call the model itself. One wrapper is kept per role and
+    # rebuilt when another model is loaded, which is cheap since dynamo caches the
+    # compiled code on the forward code object
+    wrappers = state.setdefault("compiled", {})
+    if name not in wrappers or wrappers[name][0] is not module:
+        wrappers[name] = (module, torch.compile(module, mode="reduce-overhead", fullgraph=False, dynamic=False))
+    return wrappers[name][1]
+
+
+class CompiledVAE:
+    # AutoencoderKL.encode / decode reach the encoder and decoder through self, so
+    # borrowing them routes those calls through the compiled wrappers
+    encode = AutoencoderKL.encode
+    decode = AutoencoderKL.decode
+
+    def __init__(self, vae: AutoencoderKL, state: Dict[str, Any]) -> None:
+        self.vae = vae
+        self.encoder = compile_module(state, "encoder", vae.encoder)
+        self.decoder = compile_module(state, "decoder", vae.decoder)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.vae, name)
+
+
+class CompiledControlLDM:
+    # view of a shared ControlLDM whose UNet, ControlNet and VAE run compiled. The
+    # text encoder is skipped: it only runs twice per image and its outputs must
+    # outlive later graph replays
+    forward = ControlLDM.forward
+    vae_encode = ControlLDM.vae_encode
+    vae_encode_tiled = ControlLDM.vae_encode_tiled
+    vae_decode = ControlLDM.vae_decode
+    vae_decode_tiled = ControlLDM.vae_decode_tiled
+    pair_condition = ControlLDM.pair_condition
+    prepare_cfg_condition = ControlLDM.prepare_cfg_condition
+    prepare_cfg_condition_tiled = ControlLDM.prepare_cfg_condition_tiled
+
+    def __init__(self, cldm: ControlLDM, state: Dict[str, Any]) -> None:
+        self.cldm = cldm
+        self.unet = compile_module(state, "unet", cldm.unet)
+        self.controlnet = compile_module(state, "controlnet", cldm.controlnet)
+        self.vae = CompiledVAE(cldm.vae, state)
+        self.control_scales = cldm.control_scales
+
+    def __call__(self, x_noisy: torch.Tensor, t: torch.Tensor, cond: Dict[str, torch.Tensor]) -> torch.Tensor:
+        return self.forward(x_noisy, t, cond)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.cldm, name)
+
+
 class Pipeline:
 
-    def __init__(self, stage1_model: nn.Module, cldm: ControlLDM, diffusion: Diffusion, cond_fn: Optional[Guidance], device: str, infer_type='float32', keep_stage1_loaded=True) -> None:
+    def __init__(self, stage1_model: nn.Module, cldm: ControlLDM, diffusion: Diffusion, cond_fn: Optional[Guidance], device: str, infer_type='float32', keep_stage1_loaded=True, compile_model=True) -> None:
         self.stage1_model = stage1_model
         self.cldm = cldm
         self.diffusion = diffusion
@@ -69,11 +174,195 @@ class Pipeline:
         self.final_size: Tuple[int] = None
         self.infer_type = infer_type
         self.keep_stage1_loaded = keep_stage1_loaded
+        self.state = diffusion_state(diffusion)
+        # the sampler keeps its schedule between runs with the same number of steps
+        if "sampler" not in self.state:
+            self.state["sampler"] = SpacedSampler(diffusion.betas, infer_type=infer_type)
+        self.sampler: SpacedSampler = self.state["sampler"]
+        self.sampler.infer_type = infer_type
+        # only set for stage1 models whose forward can be captured in a CUDA graph
+        self.cuda_graph_stage1 = False
+        # NHWC feeds cuDNN's tensor core convolutions, convert before compiling so
+        # that the compiled graphs are traced with the same layout
+        self.memory_format = torch.channels_last if torch.device(device).type == "cuda" else torch.contiguous_format
+        for module in (cldm.unet, cldm.controlnet, cldm.vae, stage1_model):
+            module.to(memory_format=self.memory_format)
+        # reduce-overhead mode replays CUDA graphs, so only compile on cuda
+        self.compile_model = compile_model and torch.device(device).type == "cuda"
+        if self.compile_model:
+            self.cldm = CompiledControlLDM(cldm, self.state)
+            self.stage1_model = compile_module(self.state, "stage1", stage1_model)
+            # one graph is kept per padded bucket / tile shape, make sure they all stay cached
+            torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 64)
+            # fuse the elementwise color fix passes, the output is handed back to comfy
+            # so this one must not live in a CUDA graph pool. Default dynamic lets it go
+            # shape-polymorphic after the first new size instead of recompiling per size
+            self.postprocess = torch.compile(postprocess)
+        else:
+            self.postprocess = postprocess
+
+    def autocast(self, enabled: bool=True) -> ContextManager:
+        # bfloat16 keeps float32 weights and lets autocast pick the precision per op.
+        # Other runs skip autocast entirely, older torch rejects some device types
+        # (e.g. mps) even with enabled=False
+        if self.infer_type != 'bfloat16':
+            return contextlib.nullcontext()
+        return torch.autocast(torch.device(self.device).type, dtype=torch.bfloat16, enabled=enabled)
+
+    def last_timestep(self, bs: int) -> torch.Tensor:
+        # built once and sliced, instead of a new allocation on every run
+        t_last = self.state.get("t_last")
+        if (
+            t_last is None or t_last.shape[0] < bs
+            or t_last.device.type != torch.device(self.device).type
+            # keep inference tensors out of guided runs, same as latent_noise
+            or t_last.is_inference() != torch.is_inference_mode_enabled()
+        ):
+            t_last = self.state["t_last"] = torch.full(
+                (bs, ), self.diffusion.num_timesteps - 1, dtype=torch.long, device=self.device
+            )
+        return t_last[:bs]
+
+    def latent_noise(self, shape: Tuple[int], dtype: torch.dtype) -> torch.Tensor:
+        # keep one noise buffer alive across runs and refill it in place. It stays
+        # contiguous: normal_() fills memory in order, so a channels_last buffer would
+        # permute the noise drawn for a given seed compared to torch.randn
+        buf = self.state.get("noise")
+        if (
+            buf is None or buf.shape != shape or buf.dtype != dtype
+            or buf.device.type != torch.device(self.device).type
+            # inference tensors can't be refilled outside inference mode (guided runs)
+            or buf.is_inference() != torch.is_inference_mode_enabled()
+        ):
+            buf = self.state["noise"] = torch.empty(shape, dtype=dtype, device=self.device)
+        return buf.normal_()
+
+    def pad_buckets(self, tiled: bool) -> Tuple[int]:
+        # tiled models always see tile_size inputs, bucketing would only add work
+        return PAD_BUCKETS if self.compile_model and not tiled else ()
 
     def set_final_size(self, lq: torch.Tensor) -> None:
         h, w = lq.shape[1:3]
         self.final_size = (h, w)
 
+    def tiled_scale(self, image: torch.Tensor, tile_size: int, tile_stride: int, upscale_model: nn.Module, tile_batch_size: int=4) -> torch.Tensor:
+        bs, c, h, w = image.shape
+        scale = self.stage1_scale
+        tile_size = min(tile_size, h, w)
+        tile_stride = min(tile_stride, tile_size)
+        output = torch.zeros((bs, c, h * scale, w * scale), dtype=torch.float32, device=image.device)
+        count = torch.zeros((1, 1, h * scale, w * scale), dtype=torch.float32, device=image.device)
+        # blending weights only depend on the tile size, build them once for all tiles
+        weights = gaussian_weights(tile_size * scale, tile_size * scale)[None, None]
+        weights = torch.tensor(weights, dtype=torch.float32, device=image.device)
+        tiles = sliding_windows(h, w, tile_size, tile_stride)
+        chunks = [tiles[i:i + tile_batch_size] for i in range(0, len(tiles), tile_batch_size)]
+        # stack several tiles for one forward, (n * bs, c, tile, tile)
+        gather = lambda coords: torch.cat([image[:, :, hi:hi_end, wi:wi_end] for hi, hi_end, wi, wi_end in coords])
+        # on cuda, the next batch of tiles is gathered on a side stream while the
+        # current one is upscaled
+        if image.is_cuda:
+            compute_stream = torch.cuda.current_stream(image.device)
+            copy_stream = torch.cuda.Stream(image.device)
+            copy_stream.wait_stream(compute_stream)
+        else:
+            copy_stream = None
+        pbar = comfy.utils.ProgressBar(len(tiles))
+        next_batch = gather(chunks[0])
+        graph = None
+        if (
+            image.is_cuda and self.cuda_graph_stage1 and not self.compile_model
+            and not torch.is_autocast_enabled() and len(chunks) > 1
+        ):
+            graph, static_in, static_out = self.stage1_graph(upscale_model, next_batch)
+        for i, coords in enumerate(chunks):
+            batch = next_batch
+            if copy_stream is not None and i > 0:
+                compute_stream.wait_stream(copy_stream)
+                batch.record_stream(compute_stream)
+            if i + 1 < len(chunks):
+                if copy_stream is not None:
+                    with torch.cuda.stream(copy_stream):
+                        next_batch = gather(chunks[i + 1])
+                else:
+                    next_batch = gather(chunks[i + 1])
+            if graph is not None and batch.shape == static_in.shape:
+                static_in.copy_(batch)
+                graph.replay()
+                batch_out = static_out.unflatten(0, (len(coords), bs))
+            else:
+                batch_out = upscale_model(batch).unflatten(0, (len(coords), bs))
+            for (hi, hi_end, wi, wi_end), tile_out in zip(coords, batch_out):
+                output[:, :, hi * scale:hi_end * scale, wi * scale:wi_end * scale] += tile_out * weights
+                count[:, :, hi * scale:hi_end * scale, wi * scale:wi_end * scale] += weights
+            pbar.update(len(coords))
+        output.div_(count)
+        return output.to(image.dtype)
+
+    def offload_stage1(self) -> None:
+        self.stage1_model.cpu()
+        # captured graphs keep their memory pool (static input, output and every
+        # activation) allocated, free it together with the weights for stage2
+        self.stage1_model.cuda_graph_weights = None
+        self.stage1_model.cuda_graphs = {}
+
+    def stage1_graph(self, upscale_model: nn.Module, example: torch.Tensor) -> Tuple[torch.cuda.CUDAGraph, torch.Tensor, torch.Tensor]:
+        # graphs are kept on the stage1 model, which outlives the per-run pipeline, so
+        # warmup and capture are paid once per tile batch shape instead of every image.
+        # A graph replays fixed weight addresses, drop them all once the weights moved.
+        weights = tuple(p.data_ptr() for p in upscale_model.parameters())
+        if getattr(upscale_model, "cuda_graph_weights", None) != weights:
+            upscale_model.cuda_graph_weights = weights
+            upscale_model.cuda_graphs = {}
+        # inference tensors can't be refilled outside inference mode, keep both kinds apart
+        key = (example.shape, example.stride(), example.dtype, torch.is_inference_mode_enabled())
+        if key not in upscale_model.cuda_graphs:
+            upscale_model.cuda_graphs[key] = self.capture_stage1(upscale_model, example)
+        return upscale_model.cuda_graphs[key]
+
+    def capture_stage1(self, upscale_model: nn.Module, example: torch.Tensor) -> Tuple[torch.cuda.CUDAGraph, torch.Tensor, torch.Tensor]:
+        # every full batch of tiles has the same shape, so one captured graph can be
+        # replayed for all of them instead of relaunching each kernel from python
+        static_in = example.clone()
+        warmup_stream = torch.cuda.Stream(example.device)
+        warmup_stream.wait_stream(torch.cuda.current_stream(example.device))
+        with torch.cuda.stream(warmup_stream):
+            for _ in range(2):
+                upscale_model(static_in)
+        torch.cuda.current_stream(example.device).wait_stream(warmup_stream)
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph):
+            static_out = upscale_model(static_in)
+        return graph, static_in, static_out
+
+    def tile_process(self, image, tile_size, tile_stride, upscale_model):
+        upscale_model.to(self.device)
+        in_img = image.to(self.device)
+
+        tile = tile_size
+        stride = tile_stride
+        tile_batch_size = 4
+
+        oom = True
+        while oom:
+            try:
+                s = self.tiled_scale(in_img, tile, stride, upscale_model, tile_batch_size)
+                oom = False
+            except model_management.OOM_EXCEPTION as e:
+                # release graphs cached for the failed shapes before retrying
+                upscale_model.cuda_graphs = {}
+                # fall back to fewer tiles per forward first, then to smaller tiles
+                if tile_batch_size > 1:
+                    tile_batch_size //= 2
+                    continue
+                tile //= 2
+                stride = max(stride // 2, 1)
+                if tile < 128:
+                    raise e
+
+        s = torch.clamp(s, min=0, max=1.0)
+        return s
+
     @overload
     def run_stage1(self, lq: torch.Tensor) -> torch.Tensor:
         ...
@@ -95,52 +384,45 @@ class Pipeline:
         ### preprocess
         bs, _, ori_h, ori_w = clean.shape
         # pad: ensure that height & width are multiples of 64
-        pad_clean = pad_to_multiples_of(clean, multiple=64)
+        pad_clean = pad_to_multiples_of(clean, multiple=64, buckets=self.pad_buckets(tiled))
         if self.infer_type == 'float16':
             pad_clean = pad_clean.half()
+        pad_clean = pad_clean.contiguous(memory_format=self.memory_format)
         h, w = pad_clean.shape[2:]
         
         # prepare conditon
         if not tiled:
-            cond = self.cldm.prepare_condition(pad_clean, [pos_prompt] * bs)
-            uncond = self.cldm.prepare_condition(pad_clean, [neg_prompt] * bs)
+            cond, uncond = self.cldm.prepare_cfg_condition(pad_clean, [pos_prompt] * bs, [neg_prompt] * bs)
         else:
-            cond = self.cldm.prepare_condition_tiled(pad_clean, [pos_prompt] * bs, tile_size, tile_stride)
-            uncond = self.cldm.prepare_condition_tiled(pad_clean, [neg_prompt] * bs, tile_size, tile_stride)
+            cond, uncond = self.cldm.prepare_cfg_condition_tiled(
+                pad_clean, [pos_prompt] * bs, [neg_prompt] * bs, tile_size, tile_stride
+            )
 
         if self.cond_fn:
             self.cond_fn.load_target(pad_clean * 2 - 1)
         old_control_scales = self.cldm.control_scales
         self.cldm.control_scales = [strength] * 13
+        noise_dtype = torch.float16 if self.infer_type == 'float16' else torch.float32
         if better_start:
             # using noised low frequency part of condition as a better start point of 
             # reverse sampling, which can prevent our model from generating noise in 
             # image background.
-            _, low_freq = wavelet_decomposition(pad_clean)
+            with self.autocast(enabled=False):
+                _, low_freq = wavelet_decomposition(pad_clean)
             if not tiled:
                 x_0 = self.cldm.vae_encode(low_freq)
             else:
                 x_0 = self.cldm.vae_encode_tiled(low_freq, tile_size, tile_stride)
-            if self.infer_type == 'float16':
-                x_T = self.diffusion.q_sample(
-                    x_0,
-                    torch.full((bs, ), self.diffusion.num_timesteps - 1, dtype=torch.long, device=self.device),
-                    torch.randn(x_0.shape, dtype=torch.float16, device=self.device)
-                )
-            else:
-                x_T = self.diffusion.q_sample(
-                    x_0,
-                    torch.full((bs, ), self.diffusion.num_timesteps - 1, dtype=torch.long, device=self.device),
-                    torch.randn(x_0.shape, dtype=torch.float32, device=self.device)
-                )
+            x_T = self.diffusion.q_sample(
+                x_0,
+                self.last_timestep(bs),
+                self.latent_noise(x_0.shape, noise_dtype)
+            )
         else:
-            if self.infer_type == 'float16':
-                x_T = torch.randn((bs, 4, h // 8, w // 8), dtype=torch.float16, device=self.device)
-            else:
-                x_T = torch.randn((bs, 4, h // 8, w // 8), dtype=torch.float32, device=self.device)
+            x_T = self.latent_noise((bs, 4, h // 8, w // 8), noise_dtype)
+        x_T = x_T.contiguous(memory_format=self.memory_format)
         ### run sampler
-        sampler = SpacedSampler(self.diffusion.betas, infer_type=self.infer_type)
-        z = sampler.sample(
+        z = self.sampler.sample(
             model=self.cldm, device=self.device, steps=steps, batch_size=bs, x_size=(4, h // 8, w // 8),
             cond=cond, uncond=uncond, cfg_scale=cfg_scale, x_T=x_T, progress=True,
             progress_leave=True, cond_fn=self.cond_fn, tiled=tiled, tile_size=tile_size, tile_stride=tile_stride
@@ -154,7 +436,7 @@ class Pipeline:
         sample = x[:, :, :ori_h, :ori_w]
         return sample
 
-    @torch.no_grad()
+    @inference_mode_unless_guided
     def run(
         self,
         lq: np.ndarray,
@@ -173,44 +455,51 @@ class Pipeline:
     ) -> np.ndarray:
         # image to tensor
         # lq = torch.tensor((lq / 255.).clip(0, 1), dtype=torch.float32, device=self.device)
+        # as_tensor reuses the input buffer when it already has the right dtype
         if self.infer_type == 'float16':
-            lq = torch.tensor(lq, dtype=torch.float16, device=self.device)
+            lq = torch.as_tensor(lq, dtype=torch.float16)
         else:
-            lq = torch.tensor(lq, dtype=torch.float32, device=self.device)
-        lq = rearrange(lq, "n h w c -> n c h w").contiguous()
+            lq = torch.as_tensor(lq, dtype=torch.float32)
+        if torch.device(self.device).type == "cuda" and lq.device.type == "cpu":
+            # upload from pinned memory so the copy doesn't block the host
+            lq = lq.pin_memory()
+        lq = lq.to(self.device, non_blocking=True)
+        # an nhwc tensor permuted to nchw already has channels_last strides
+        lq = lq.permute(0, 3, 1, 2).contiguous(memory_format=self.memory_format)
         # set pipeline output size
         
         t_s = time.time()
         self.set_final_size(lq)
-        clean = self.run_stage1(lq, stage1_tile, stage1_tile_size, stage1_tile_stride)
+        with self.autocast():
+            clean = self.run_stage1(lq, stage1_tile, stage1_tile_size, stage1_tile_stride)
+        # outputs of compiled models live in the shared CUDA graph pool and are
+        # overwritten by the next replay, so keep our own copy for stage2
+        clean = clean.to(lq.dtype, copy=self.compile_model)
         t_e = time.time()
         print(f'stage1 time: {t_e - t_s}')
 
         t_s = time.time()
-        sample = self.run_stage2(
-            clean, steps, strength, tiled, tile_size, tile_stride,
-            pos_prompt, neg_prompt, cfg_scale, better_start
-        )
+        with self.autocast():
+            sample = self.run_stage2(
+                clean, steps, strength, tiled, tile_size, tile_stride,
+                pos_prompt, neg_prompt, cfg_scale, better_start
+            )
+        # keep the color fix in full precision
+        sample = sample.to(clean.dtype)
         t_e = time.time()
         print(f'stage2 time: {t_e - t_s}')
 
-        # colorfix (borrowed from StableSR, thanks for their work)
-        sample = (sample + 1) / 2
-        sample = wavelet_reconstruction(sample, clean)
-        # resize to desired output size
-        sample = F.interpolate(sample, size=self.final_size, mode="bicubic", antialias=True)
-        # tensor to image
-        sample = rearrange(sample, "n c h w -> n h w c")
-
-        return sample
+        return self.postprocess(sample, clean, self.final_size)
 
 
 class BSRNetPipeline(Pipeline):
 
-    def __init__(self, bsrnet: RRDBNet, cldm: ControlLDM, diffusion: Diffusion, cond_fn: Optional[Guidance], device: str, upscale: float, infer_type='float32', keep_stage1_loaded=True) -> None:
-        super().__init__(bsrnet, cldm, diffusion, cond_fn, device, infer_type)
+    def __init__(self, bsrnet: RRDBNet, cldm: ControlLDM, diffusion: Diffusion, cond_fn: Optional[Guidance], device: str, upscale: float, infer_type='float32', keep_stage1_loaded=True, compile_model=True) -> None:
+        super().__init__(bsrnet, cldm, diffusion, cond_fn, device, infer_type, compile_model=compile_model)
         self.upscale = upscale
         self.stage1_scale = 4
+        # RRDBNet is convolutions only, safe to capture
+        self.cuda_graph_stage1 = True
         self.device = device
         self.infer_type = infer_type
         self.keep_stage1_loaded = keep_stage1_loaded
@@ -219,38 +508,6 @@ class BSRNetPipeline(Pipeline):
         h, w = lq.shape[2:]
         self.final_size = (int(h * self.upscale), int(w * self.upscale))
 
-    def tile_process(self, image, tile_size, tile_stride, upscale_model):
-        # device = model_management.get_torch_device()
-        # if self.device == 'cuda':
-        #     memory_required = model_management.module_size(upscale_model)
-        #     memory_required += (512 * 512 * 3) * image.element_size() * max(self.stage1_scale, 1.0) * 384.0 #The 384.0 is an estimate of how much some of these models take, TODO: make it more accurate
-        #     memory_required += image.nelement() * image.element_size()
-        #     model_management.free_memory(memory_required, self.device)
-
-        upscale_model.to(self.device)
-        in_img = image.to(self.device)
-
-        tile = tile_size
-        overlap = tile_size - tile_stride
-
-        oom = True
-        while oom:
-            try:
-                steps = in_img.shape[0] * comfy.utils.get_tiled_scale_steps(in_img.shape[3], in_img.shape[2], tile_x=tile, tile_y=tile, overlap=overlap)
-                pbar = comfy.utils.ProgressBar(steps)
-                s = comfy.utils.tiled_scale(in_img, lambda a: upscale_model(a), tile_x=tile, tile_y=tile, overlap=overlap, upscale_amount=self.stage1_scale, pbar=pbar)
-                oom = False
-            except model_management.OOM_EXCEPTION as e:
-                tile //= 2
-                if tile < 128:
-                    raise e
-
-        # upscale_model.cpu()
-        s = torch.clamp(s, min=0, max=1.0)
-        s = s.to(self.device)
-
-        return s
-
     @count_vram_usage
     def run_stage1(self, lq: torch.Tensor, stage1_tile, tile_size=512, tile_stride=256) -> torch.Tensor:
         # NOTE: default upscale 4x in stage1
@@ -260,20 +517,20 @@ class BSRNetPipeline(Pipeline):
             clean = self.stage1_model(lq)
 
         if not self.keep_stage1_loaded:
-            self.stage1_model.cpu()
+            self.offload_stage1()
 
         if min(self.final_size) < 512:
             clean = resize_short_edge_to(clean, size=512)
         else:
-            clean = F.interpolate(clean, size=self.final_size, mode="bicubic", antialias=True)
+            clean = resize_to(clean, self.final_size)
 
         return clean
 
 
 class SwinIRPipeline(Pipeline):
 
-    def __init__(self, swinir: SwinIR, cldm: ControlLDM, diffusion: Diffusion, cond_fn: Optional[Guidance], device: str, upscale: float, infer_type='float32', keep_stage1_loaded=True) -> None:
-        super().__init__(swinir, cldm, diffusion, cond_fn, device, infer_type, keep_stage1_loaded)
+    def __init__(self, swinir: SwinIR, cldm: ControlLDM, diffusion: Diffusion, cond_fn: Optional[Guidance], device: str, upscale: float, infer_type='float32', keep_stage1_loaded=True, compile_model=True) -> None:
+        super().__init__(swinir, cldm, diffusion, cond_fn, device, infer_type, keep_stage1_loaded, compile_model)
         self.upscale = upscale
         self.stage1_scale = 1
         self.device = device
@@ -284,44 +541,13 @@ class SwinIRPipeline(Pipeline):
         h, w = lq.shape[2:]
         self.final_size = (int(h * self.upscale), int(w * self.upscale))
 
-    def tile_process(self, image, tile_size, tile_stride, upscale_model):
-        # if self.device == 'cuda':
-        #     memory_required = model_management.module_size(upscale_model)
-        #     memory_required += (512 * 512 * 3) * image.element_size() * max(self.stage1_scale, 1.0) * 384.0 #The 384.0 is an estimate of how much some of these models take, TODO: make it more accurate
-        #     memory_required += image.nelement() * image.element_size()
-        #     model_management.free_memory(memory_required, self.device)
-
-        upscale_model.to(self.device)
-        in_img = image.to(self.device)
-
-        tile = tile_size
-        overlap = tile_size - tile_stride
-
-        oom = True
-        while oom:
-            try:
-                steps = in_img.shape[0] * comfy.utils.get_tiled_scale_steps(in_img.shape[3], in_img.shape[2], tile_x=tile, tile_y=tile, overlap=overlap)
-                pbar = comfy.utils.ProgressBar(steps)
-                s = comfy.utils.tiled_scale(in_img, lambda a: upscale_model(a), tile_x=tile, tile_y=tile, overlap=overlap, upscale_amount=self.stage1_scale, pbar=pbar)
-                oom = False
-            except model_management.OOM_EXCEPTION as e:
-                tile //= 2
-                if tile < 128:
-                    raise e
-
-        # upscale_model.cpu()
-        s = torch.clamp(s, min=0, max=1.0)
-        s = s.to(self.device)
-
-        return s
-
     @count_vram_usage
     def run_stage1(self, lq: torch.Tensor, stage1_tile, tile_size=512, tile_stride=256) -> torch.Tensor:
         if min(lq.shape[2:]) < 512:
             lq = resize_short_edge_to(lq, size=512)
         ori_h, ori_w = lq.shape[2:]
         # pad: ensure that height & width are multiples of 64
-        pad_lq = pad_to_multiples_of(lq, multiple=64)
+        pad_lq = pad_to_multiples_of(lq, multiple=64, buckets=self.pad_buckets(stage1_tile))
 
         # NOTE: default upscale 4x in stage1
         if stage1_tile:
@@ -329,7 +555,7 @@ class SwinIRPipeline(Pipeline):
         else:
             clean = self.stage1_model(pad_lq)
         if not self.keep_stage1_loaded:
-            self.stage1_model.cpu()
+            self.offload_stage1()
 
         clean = clean[:, :, :ori_h, :ori_w]
 
@@ -338,8 +564,8 @@ class SwinIRPipeline(Pipeline):
 
 class SCUNetPipeline(Pipeline):
 
-    def __init__(self, scunet: SCUNet, cldm: ControlLDM, diffusion: Diffusion, cond_fn: Optional[Guidance], device: str, upscale: float, infer_type='float32', keep_stage1_loaded=True) -> None:
-        super().__init__(scunet, cldm, diffusion, cond_fn, device, infer_type, keep_stage1_loaded)
+    def __init__(self, scunet: SCUNet, cldm: ControlLDM, diffusion: Diffusion, cond_fn: Optional[Guidance], device: str, upscale: float, infer_type='float32', keep_stage1_loaded=True, compile_model=True) -> None:
+        super().__init__(scunet, cldm, diffusion, cond_fn, device, infer_type, keep_stage1_loaded, compile_model)
         self.upscale = upscale
         self.stage1_scale = 1
         self.device = device
@@ -350,37 +576,6 @@ class SCUNetPipeline(Pipeline):
         h, w = lq.shape[2:]
         self.final_size = (int(h * self.upscale), int(w * self.upscale))
 
-    def tile_process(self, image, tile_size, tile_stride, upscale_model):
-        # if self.device == 'cuda':
-        #     memory_required = model_management.module_size(upscale_model)
-        #     memory_required += (512 * 512 * 3) * image.element_size() * max(self.stage1_scale, 1.0) * 384.0 #The 384.0 is an estimate of how much some of these models take, TODO: make it more accurate
-        #     memory_required += image.nelement() * image.element_size()
-        #     model_management.free_memory(memory_required, self.device)
-
-        upscale_model.to(self.device)
-        in_img = image.to(self.device)
-
-        tile = tile_size
-        overlap = tile_size - tile_stride
-
-        oom = True
-        while oom:
-            try:
-                steps = in_img.shape[0] * comfy.utils.get_tiled_scale_steps(in_img.shape[3], in_img.shape[2], tile_x=tile, tile_y=tile, overlap=overlap)
-                pbar = comfy.utils.ProgressBar(steps)
-                s = comfy.utils.tiled_scale(in_img, lambda a: upscale_model(a), tile_x=tile, tile_y=tile, overlap=overlap, upscale_amount=self.stage1_scale, pbar=pbar)
-                oom = False
-            except model_management.OOM_EXCEPTION as e:
-                tile //= 2
-                if tile < 128:
-                    raise e
-
-        # upscale_model.cpu()
-        s = torch.clamp(s, min=0, max=1.0)
-        s = s.to(self.device)
-
-        return s
-
     @count_vram_usage
     def run_stage1(self, lq: torch.Tensor, stage1_tile, tile_size=512, tile_stride=256) -> torch.Tensor:
         # NOTE: default upscale 4x in stage1
@@ -389,7 +584,7 @@ class SCUNetPipeline(Pipeline):
         else:
             clean = self.stage1_model(lq)
         if not self.keep_stage1_loaded:
-            self.stage1_model.cpu()
+            self.offload_stage1()
 
         if min(self.final_size) < 512:
             clean = resize_short_edge_to(clean, size=512)
@@ -80,11 +80,14 @@ class SpacedSampler(nn.Module):
         self.original_alphas_cumprod = np.cumprod(1.0 - betas, axis=0)
         self.context = {}
         self.infer_type = infer_type
+        self.schedule_steps = None
 
     def register(self, name: str, value: np.ndarray) -> None:
         self.register_buffer(name, torch.tensor(value, dtype=torch.float32))
     
     def make_schedule(self, num_steps: int) -> None:
+        if num_steps == self.schedule_steps:
+            return
         # calcualte betas for spaced sampling
         # https://github.com/openai/guided-diffusion/blob/main/guided_diffusion/respace.py
         used_timesteps = space_timesteps(self.num_timesteps, str(num_steps))
@@ -129,6 +132,7 @@ class SpacedSampler(nn.Module):
         self.register("posterior_log_variance_clipped", posterior_log_variance_clipped)
         self.register("posterior_mean_coef1", posterior_mean_coef1)
         self.register("posterior_mean_coef2", posterior_mean_coef2)
+        self.schedule_steps = num_steps
 
     def q_posterior_mean_variance(self, x_start: torch.Tensor, x_t: torch.Tensor, t: torch.Tensor) -> Tuple[torch.Tensor]:
         """
@@ -216,15 +220,14 @@ class SpacedSampler(nn.Module):
         x: torch.Tensor,
         t: torch.Tensor,
         cond: Dict[str, torch.Tensor],
-        uncond: Optional[Dict[str, torch.Tensor]],
-        cfg_scale: float
+        cfg_scale: float,
+        batched_cfg: bool
     ) -> torch.Tensor:
-        if uncond is None or cfg_scale == 1.:
+        if not batched_cfg:
             model_output = model(x, t, cond)
         else:
-            # apply classifier-free guidance
-            model_cond = model(x, t, cond)
-            model_uncond = model(x, t, uncond)
+            # apply classifier-free guidance, cond holds cond and uncond as one batch (see sample)
+            model_cond, model_uncond = model(torch.cat((x, x)), torch.cat((t, t)), cond).chunk(2)
             model_output = model_uncond + cfg_scale * (model_cond - model_uncond)
         return model_output
     
@@ -235,8 +238,8 @@ class SpacedSampler(nn.Module):
         x: torch.Tensor,
         t: torch.Tensor,
         cond: Dict[str, torch.Tensor],
-        uncond: Optional[Dict[str, torch.Tensor]],
         cfg_scale: float,
+        batched_cfg: bool,
         tile_size: int,
         tile_stride: int
     ):
@@ -253,12 +256,7 @@ class SpacedSampler(nn.Module):
                 "c_img": cond["c_img"][:, :, hi:hi_end, wi:wi_end],
                 "c_txt": cond["c_txt"]
             }
-            if uncond:
-                tile_uncond = {
-                    "c_img": uncond["c_img"][:, :, hi:hi_end, wi:wi_end],
-                    "c_txt": uncond["c_txt"]
-                }
-            tile_eps = self.predict_noise(model, tile_x, t, tile_cond, tile_uncond, cfg_scale)
+            tile_eps = self.predict_noise(model, tile_x, t, tile_cond, cfg_scale, batched_cfg)
             # accumulate noise
             eps[:, :, hi:hi_end, wi:wi_end] += tile_eps * weights
             count[:, :, hi:hi_end, wi:wi_end] += weights
@@ -274,17 +272,17 @@ class SpacedSampler(nn.Module):
         t: torch.Tensor,
         index: torch.Tensor,
         cond: Dict[str, torch.Tensor],
-        uncond: Optional[Dict[str, torch.Tensor]],
         cfg_scale: float,
+        batched_cfg: bool,
         cond_fn: Optional[Guidance],
         tiled: bool,
         tile_size: int,
         tile_stride: int
     ) -> torch.Tensor:
         if tiled:
-            eps = self.predict_noise_tiled(model, x, t, cond, uncond, cfg_scale, tile_size, tile_stride)
+            eps = self.predict_noise_tiled(model, x, t, cond, cfg_scale, batched_cfg, tile_size, tile_stride)
         else:
-            eps = self.predict_noise(model, x, t, cond, uncond, cfg_scale)
+            eps = self.predict_noise(model, x, t, cond, cfg_scale, batched_cfg)
         pred_x0 = self._predict_xstart_from_eps(x, index, eps)
         if cond_fn:
             assert not tiled, f"tiled sampling currently doesn't support guidance"
@@ -330,13 +328,20 @@ class SpacedSampler(nn.Module):
 
         timesteps = np.flip(self.timesteps) # [1000, 950, 900, ...]
         total_steps = len(self.timesteps)
+        # build the timestep & index tensors of all steps at once, one row per step
+        all_ts = torch.tensor(timesteps.copy(), dtype=torch.long, device=device)[:, None].repeat(1, batch_size)
+        all_index = torch.arange(total_steps - 1, -1, -1, dtype=torch.long, device=device)[:, None].repeat(1, batch_size)
+        batched_cfg = uncond is not None and cfg_scale != 1.
+        if batched_cfg:
+            # cond and uncond go through the model as one batch, concat them once for all steps
+            cond = {k: torch.cat((cond[k], uncond[k])) for k in cond}
         iterator = tqdm(timesteps, total=total_steps, leave=progress_leave, disable=not progress)
         for i, step in enumerate(iterator):
-            ts = torch.full((batch_size,), step, device=device, dtype=torch.long)
-            index = torch.full_like(ts, fill_value=total_steps - i - 1)
+            ts = all_ts[i]
+            index = all_index[i]
 
             img = self.p_sample(
-                model, img, ts, index, cond, uncond, cfg_scale, cond_fn,
+                model, img, ts, index, cond, cfg_scale, batched_cfg, cond_fn,
                 tiled, tile_size, tile_stride
             )
             if cond_fn and self.context["g_apply"]:
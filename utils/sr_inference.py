@@ -104,7 +104,7 @@ class BSRInferenceLoop(InferenceLoop):
         self.keep_stage1_loaded = keep_stage1_loaded
 
     def init_pipeline(self) -> None:
-        self.pipeline = BSRNetPipeline(self.bsrnet, self.cldm, self.diffusion, self.cond_fn, self.args.device, self.args.upscale, self.infer_type, self.keep_stage1_loaded)
+        self.pipeline = BSRNetPipeline(self.bsrnet, self.cldm, self.diffusion, self.cond_fn, self.args.device, self.args.upscale, self.infer_type, self.keep_stage1_loaded, self.args.compile_model)
 
 
 class BFRInferenceLoop(InferenceLoop):
@@ -116,7 +116,7 @@ class BFRInferenceLoop(InferenceLoop):
         self.keep_stage1_loaded = keep_stage1_loaded
 
     def init_pipeline(self) -> None:
-        self.pipeline = SwinIRPipeline(self.swinir_face, self.cldm, self.diffusion, self.cond_fn, self.args.device, self.args.upscale, self.infer_type, self.keep_stage1_loaded)
+        self.pipeline = SwinIRPipeline(self.swinir_face, self.cldm, self.diffusion, self.cond_fn, self.args.device, self.args.upscale, self.infer_type, self.keep_stage1_loaded, self.args.compile_model)
 
 
 class BIDInferenceLoop(InferenceLoop):
@@ -128,4 +128,4 @@ class BIDInferenceLoop(InferenceLoop):
         self.keep_stage1_loaded = keep_stage1_loaded
 
     def init_pipeline(self) -> None:
-        self.pipeline = SCUNetPipeline(self.scunet_psnr, self.cldm, self.diffusion, self.cond_fn, self.args.device, self.args.upscale, self.infer_type, self.keep_stage1_loaded)
+        self.pipeline = SCUNetPipeline(self.scunet_psnr, self.cldm, self.diffusion, self.cond_fn, self.args.device, self.args.upscale, self.infer_type, self.keep_stage1_loaded, self.args.compile_model)